@@ -1,27 +1,49 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from kneed import KneeLocator
-from tqdm.notebook import tqdm
+from joblib import Parallel, delayed
 
 
-def optimize_n_clusters(data, r=(2, 50), plot=True):
+def _inertia(data, k, batch_size=4096, n_init=3):
+    """
+    Auxiliary function to get the inertia of a single fit
+    (plain KMeans for data smaller than a few batches, MiniBatchKMeans otherwise)
+    """
+    if data.shape[0] < 3 * batch_size:
+        return KMeans(n_clusters=k, n_init=n_init, random_state=0).fit(data).inertia_
+    return MiniBatchKMeans(n_clusters=k, batch_size=batch_size, n_init=n_init, random_state=0).fit(data).inertia_
+
+
+def optimize_n_clusters(data, r=(2, 50), plot=True, n_jobs=-1, backend='sklearn', batch_size=4096, n_init=3):
     """
     Runs knee-location to determine the most efficient value of n_clusters for KMeans.
+    Fits for different n_clusters are independent, so they run in parallel. Data of 3 * batch_size rows or more
+    is fit with MiniBatchKMeans, whose inertia is noisier than KMeans', so the selected value may differ
+    from a plain KMeans sweep.
 
     Parameters:
         data: (csr_matrix): data for clustering
         r: (tuple(int, int)): range of values to iterate over
         plot: (bool): whether or not to plot the results
+        n_jobs: (int): number of processes to run the fits in (-1 stands for all cores)
+        backend: (str): either sklearn (KMeans/MiniBatchKMeans) or numba (a simple Lloyd's KMeans with k-means++
+        seeding on the sparse data with numba kernels, parallel inside each fit, requires numba)
+        batch_size: (int): MiniBatchKMeans batch size (sklearn backend)
+        n_init: (int): number of runs with different seeds per n_clusters (sklearn backend)
 
     Returns:
         knee.knee: (int): optimal value of n_clusters
 
     """
     K = range(r[0], r[1])
-    inertia = []
-    for k in tqdm(K):
-        inertia.append(KMeans(n_clusters=k).fit(data).inertia_)
+    if backend == 'sklearn':
+        inertia = Parallel(n_jobs=n_jobs)(delayed(_inertia)(data, k, batch_size, n_init) for k in K)
+    elif backend == 'numba':
+        from auxiliary.NumbaKMeans import kmeans_inertia
+        inertia = [kmeans_inertia(data, k) for k in K]
+    else:
+        raise Exception('This backend is not supported')
 
     i = np.arange(len(inertia))
     knee = KneeLocator(i, inertia, S=1, curve='convex', direction='decreasing', interp_method='polynomial')
@@ -48,12 +70,8 @@ def cluster_sizes(labels):
         d: (dict): dictionary of labels and quantities of entries, corresponding to each label
 
     """
-    d = {}
-    for l in labels:
-        if not d.get(l):
-            d[l] = 1
-        else:
-            d[l] += 1
+    u, c = np.unique(np.asarray(labels), return_counts=True)
+    d = dict(zip(u.tolist(), c.tolist()))
     return d
 
 
@@ -71,8 +89,8 @@ def get_top_features(data, labels, cluster: int, names):
         res: (list): list of names of top features among the chosen cluster
 
     """
-    tfidf_sorting = np.argsort(np.sum(data[labels == cluster].toarray(), axis=0))[::-1]
-    res = []
-    for i in tfidf_sorting[:6]:
-        res.append(names[i])
+    tfidf_sums = np.asarray(data[labels == cluster].sum(axis=0)).ravel()
+    top = np.argpartition(-tfidf_sums, 6)[:6] if tfidf_sums.size > 6 else np.arange(tfidf_sums.size)
+    top = top[np.argsort(-tfidf_sums[top])]
+    res = [names[i] for i in top]
     return res
@@ -0,0 +1,94 @@
+import numpy as np
+from numba import njit, prange
+from scipy.sparse import csr_matrix
+from sklearn.cluster import kmeans_plusplus
+
+
+@njit(parallel=True, fastmath=True)
+def _kmeans_assign(X_data, X_indices, X_indptr, centers, centers_sq, labels, distances):
+    """
+    Assigns every row of a CSR matrix to the nearest center (squared euclidean distance)
+    """
+    n_rows = X_indptr.shape[0] - 1
+    n_clusters = centers.shape[0]
+    for i in prange(n_rows):
+        start, end = X_indptr[i], X_indptr[i + 1]
+        row_sq = 0.0
+        for j in range(start, end):
+            row_sq += X_data[j] * X_data[j]
+
+        best, best_d = 0, np.inf
+        for c in range(n_clusters):
+            dot = 0.0
+            for j in range(start, end):
+                dot += X_data[j] * centers[c, X_indices[j]]
+            d = row_sq - 2 * dot + centers_sq[c]
+            if d < best_d:
+                best, best_d = c, d
+        labels[i] = best
+        distances[i] = max(best_d, 0.0)
+
+
+@njit(fastmath=True)
+def _kmeans_update(X_data, X_indices, X_indptr, labels, centers):
+    """
+    Recomputes centers as means of their rows, empty clusters keep their previous centers
+    """
+    new_centers = np.zeros_like(centers)
+    counts = np.zeros(centers.shape[0], dtype=np.int64)
+    for i in range(X_indptr.shape[0] - 1):
+        c = labels[i]
+        counts[c] += 1
+        for j in range(X_indptr[i], X_indptr[i + 1]):
+            new_centers[c, X_indices[j]] += X_data[j]
+
+    for c in range(centers.shape[0]):
+        if counts[c] == 0:
+            new_centers[c] = centers[c]
+        else:
+            new_centers[c] /= counts[c]
+    return new_centers
+
+
+def _lloyd(X, centers, max_iter: int, tol: float) -> float:
+    """
+    Runs Lloyd's iterations from the given centers and returns the final inertia
+    """
+    labels = np.empty(X.shape[0], dtype=np.int64)
+    distances = np.empty(X.shape[0], dtype=np.float64)
+    inertia = np.inf
+    for _ in range(max_iter):
+        _kmeans_assign(X.data, X.indices, X.indptr, centers, (centers ** 2).sum(axis=1), labels, distances)
+        prev, inertia = inertia, distances.sum()
+        if prev - inertia <= tol * inertia:
+            break
+        centers = _kmeans_update(X.data, X.indices, X.indptr, labels, centers)
+    return inertia
+
+
+def kmeans_inertia(data, k: int, n_init: int = 3, max_iter: int = 100, tol: float = 1e-4,
+                   random_state: int = 0) -> float:
+    """
+    Runs Lloyd's KMeans with numba kernels directly on a sparse matrix and returns its inertia.
+    Centers are seeded with k-means++, the best of n_init runs is kept
+
+    Parameters:
+        data: (csr_matrix): data for clustering
+        k: (int): number of clusters
+        n_init: (int): number of runs with different k-means++ seeds
+        max_iter: (int): maximum number of iterations
+        tol: (float): relative inertia improvement below which the iterations stop
+        random_state: (int): seed for the k-means++ initialization
+
+    Returns:
+        inertia: (float): sum of squared distances of rows to their closest center (lowest among the runs)
+    """
+    X = csr_matrix(data, dtype=np.float64)
+    X.sort_indices()
+    rng = np.random.RandomState(random_state)
+
+    best = np.inf
+    for _ in range(n_init):
+        centers, _ = kmeans_plusplus(X, k, random_state=rng)
+        best = min(best, _lloyd(X, np.ascontiguousarray(centers, dtype=np.float64), max_iter, tol))
+    return best
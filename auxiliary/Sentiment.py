@@ -1,5 +1,7 @@
+import os
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
+from torch.utils.data import DataLoader
 import numpy as np
 from tqdm.notebook import tqdm
 
@@ -10,6 +12,66 @@ tokenizer = AutoTokenizer.from_pretrained("cointegrated/LaBSE-en-ru")
 model_path = "auxiliary/labse_sentiment_finetuned/"
 model = AutoModelForSequenceClassification.from_pretrained(model_path, num_labels=3)
 
+onnx_path = "auxiliary/labse_onnx/"
+onnx_files = [os.path.join(onnx_path, "model_quantized.onnx"), os.path.join(onnx_path, "model.onnx")]
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _open_ort_session(path=None):
+    """
+    Auxiliary function to open an onnxruntime session for CPU inference (the quantized model is preferred
+    if path is not given). Returns None on GPU, without an exported model or without onnxruntime installed
+    """
+    if path is None:
+        path = next((f for f in onnx_files if os.path.isfile(f)), None)
+    if device != "cpu" or path is None:
+        return None
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        return None
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.intra_op_num_threads = os.cpu_count()
+    return ort.InferenceSession(path, sess_options, providers=["CPUExecutionProvider"])
+
+
+ort_session = _open_ort_session()
+
+model.eval()
+if device == "cuda":
+    model = model.half().to(device)  # fp16 weights and activations, token ids stay int64
+elif ort_session is None:
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(quantize=True):
+    """
+    One-time conversion of the finetuned model to ONNX with dynamic int8 quantization.
+    Right after the export (and on later imports, once the exported model is in onnx_path) CPU inference in
+    get_sentiments() goes through onnxruntime (requires optimum[onnxruntime])
+
+    Parameters:
+        quantize: (bool): whether to quantize the exported model (otherwise it is only saved as model.onnx
+        and an earlier quantized export is removed)
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    ORTModelForSequenceClassification.from_pretrained(model_path, export=True).save_pretrained(onnx_path)
+    if quantize:
+        # an earlier quantized export may be in onnx_path as well, so the source file is named explicitly
+        quantizer = ORTQuantizer.from_pretrained(onnx_path, file_name="model.onnx")
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=onnx_path, quantization_config=qconfig)
+    elif os.path.isfile(onnx_files[0]):
+        os.remove(onnx_files[0])  # otherwise the stale quantized model would be preferred on the next import
+
+    global ort_session
+    ort_session = _open_ort_session(onnx_files[0] if quantize else onnx_files[1])
+
 
 def tokenize_function_sentences(examples):
     """
@@ -18,26 +80,44 @@ def tokenize_function_sentences(examples):
     return tokenizer(examples, padding=True, truncation=True, max_length=300, return_tensors='pt')
 
 
-def get_sentiments(texts, batch_size=10):
+def get_sentiments(texts, batch_size=32, labels=False, num_workers=None):
     """
-    Function to get the sentiments for a list of texts
+    Function to get the sentiments for a list of texts.
+    Texts are sorted by length before batching, so that each batch is padded to a similar length,
+    and the predictions are put back into the original order afterwards.
+    On GPU batches are tokenized by DataLoader workers into pinned memory while the previous ones are processed.
 
     Parameters:
         texts: (list(str)): list of texts to be sentimentally assessed
         batch_size: (int): batch size to tweak RAM load and swiftness of the process
+        labels: (bool): whether to return sentiment names (see label_dct) instead of their numeric values
+        num_workers: (int): number of tokenizing DataLoader workers (by default 2 on GPU, 0 on CPU)
 
     Returns:
         predictions: (list(int)): list of predicted sentiment values, where 0 - negative, 1 - neutral, 2 - positive
     """
+    if num_workers is None:
+        num_workers = 2 if device == "cuda" else 0
+
+    order = np.argsort([len(t) for t in texts], kind='stable')
+    loader = DataLoader([texts[j] for j in order], batch_size=batch_size, shuffle=False,
+                        collate_fn=tokenize_function_sentences, num_workers=num_workers,
+                        pin_memory=device == "cuda")
 
-    predictions = []
-    for i in tqdm(range(0, len(texts), batch_size)):
-        X_tokens = tokenize_function_sentences(texts[i:i + batch_size])
-        test_preds = model(**X_tokens).logits.detach().numpy()
-        test_preds = [np.argmax(i) for i in test_preds]
-        predictions += test_preds
+    batch_preds = []
+    for X_tokens in tqdm(loader):
+        if ort_session is not None:
+            inputs = {inp.name: X_tokens[inp.name].numpy() for inp in ort_session.get_inputs()}
+            batch_preds.append(torch.from_numpy(ort_session.run(None, inputs)[0].argmax(axis=-1)))
+            continue
+        with torch.inference_mode():
+            logits = model(**{k: v.to(device, non_blocking=True) for k, v in X_tokens.items()}).logits
+        batch_preds.append(logits.argmax(dim=-1))  # stays on device, copied back once below
 
-    for p in predictions:
-        p = label_dct[p]
+    predictions = np.empty(len(texts), dtype=np.int8)
+    if batch_preds:
+        predictions[order] = torch.cat(batch_preds).cpu().numpy()
 
-    return predictions
+    if labels:
+        return [label_dct[p] for p in predictions]
+    return predictions.tolist()
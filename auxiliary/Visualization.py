@@ -5,7 +5,7 @@ import plotly.express as px
 import pandas as pd
 
 
-def kmeans_vis(data, kmeans: KMeans, feature_names: callable, filename="kmeans_vis.html"):
+def kmeans_vis(data, kmeans: KMeans, feature_names: callable, filename="kmeans_vis.html", embedding_method='tsne'):
     """
     Produces an interactive html-file with visualization of clusters and their most valuable features using tweaked
     pyLDAvis.
@@ -15,13 +15,13 @@ def kmeans_vis(data, kmeans: KMeans, feature_names: callable, filename="kmeans_v
         kmeans: (KMeans): instance of a clustering algorithm to get the labels and cluster centroids from
         feature_names: (callable): function to retrieve the names for the features from vectorizer
         filename: (str): name for a final visualization file
+        embedding_method: (str): embedding of cluster centroids on the plot (either tsne or pca)
 
     """
 
     prep = kmeans_to_prepared_data(data, feature_names, kmeans.cluster_centers_,
-                                   kmeans.labels_, embedding_method='tsne')
-    with open(filename, "w") as f:
-        pyLDAvis.save_html(prep, f)
+                                   kmeans.labels_, embedding_method=embedding_method)
+    pyLDAvis.save_html(prep, filename)
 
 
 def visualise(df: pd.DataFrame, column: str, flag=False) -> None:
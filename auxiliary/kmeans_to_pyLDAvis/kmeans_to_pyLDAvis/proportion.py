@@ -187,4 +187,6 @@ def _coordinates_pca(centers):
     return PCA(n_components=2).fit_transform(centers)
 
 def _coordinates_tsne(centers):
-    return TSNE(n_components=2, metric='cosine').fit_transform(centers)
\ No newline at end of file
+    # only the cluster centers are embedded, perplexity has to stay below their number
+    perplexity = min(30.0, centers.shape[0] - 1)
+    return TSNE(n_components=2, metric='cosine', perplexity=perplexity).fit_transform(centers)
\ No newline at end of file
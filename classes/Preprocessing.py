@@ -1,9 +1,111 @@
+import re
+from functools import lru_cache
 import pandas as pd
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
 from nltk.stem import SnowballStemmer, PorterStemmer
 from pymorphy2 import MorphAnalyzer
 
 
+@lru_cache(maxsize=1)
+def _morph() -> MorphAnalyzer:
+    """
+    Shared pymorphy2 analyzer, loads the dictionaries on the first call only
+    """
+    return MorphAnalyzer()
+
+
+@lru_cache(maxsize=1)
+def _ru_stemmer() -> SnowballStemmer:
+    """
+    Shared russian Snowball stemmer
+    """
+    return SnowballStemmer(language='russian')
+
+
+@lru_cache(maxsize=1)
+def _en_stemmer() -> PorterStemmer:
+    """
+    Shared english Porter stemmer
+    """
+    return PorterStemmer()
+
+
+# below this many documents worker start-up costs more than it saves
+_PARALLEL_MIN_ROWS = 10_000
+
+
+@lru_cache(maxsize=200_000)
+def _lemma_one(token: str) -> str:
+    """
+    Cached pymorphy2 normal form of a single token
+    """
+    return _morph().normal_forms(token)[0]
+
+
+@lru_cache(maxsize=200_000)
+def _lemma_pos_one(token: str) -> str:
+    """
+    Cached pymorphy2 normal form of a single token with its POS-tag attached
+    """
+    return _lemma_one(token) + '_' + _morph().parse(token)[0].tag.POS
+
+
+@lru_cache(maxsize=200_000)
+def _stem_one(token: str) -> str:
+    """
+    Cached russian, then english stem of a single token
+    """
+    return _en_stemmer().stem(_ru_stemmer().stem(token))
+
+
+def _split(doc: str, phrases=None) -> list:
+    """
+    Splits a document into tokens, first removing multi-word stop-phrases in a single Aho-Corasick pass
+    (phrases is a pyahocorasick automaton of space-padded phrases with their lengths as values)
+    """
+    if phrases is None:
+        return doc.split()
+
+    # padding puts the word boundaries into the match itself, a phrase may share its closing space
+    # with the opening space of the next one
+    doc = ' ' + ' '.join(doc.split()) + ' '
+    matches = sorted(((end - length + 1, end) for end, length in phrases.iter(doc)), key=lambda m: (m[0], -m[1]))
+    kept, last = [], 0
+    for start, end in matches:
+        if start >= last:
+            kept.append(doc[last:start])
+            last = end
+    kept.append(doc[last:])
+    return ' '.join(kept).split()
+
+
+def _lemmatize_chunk(chunk, stop_words: frozenset = frozenset(), pos: bool = False, phrases=None) -> list:
+    """
+    Lemmatizes a chunk of documents, dropping stop-words and words of 2 characters or less
+    (runs inside joblib workers as well)
+    """
+    res = []
+    for x in chunk:
+        tokens = []
+        for t in _split(x, phrases):
+            lemma = _lemma_one(t)
+            if len(lemma) > 2 and t not in stop_words and lemma not in stop_words:
+                tokens.append(_lemma_pos_one(t) if pos else lemma)
+        res.append(' '.join(tokens))
+    return res
+
+
+def _stem_chunk(chunk, stop_words: frozenset = frozenset(), phrases=None) -> list:
+    """
+    Stems a chunk of documents, dropping stop-words and words of 2 characters or less
+    (runs inside joblib workers as well)
+    """
+    return [' '.join([stem for t in _split(x, phrases)
+                      if len(stem := _stem_one(t)) > 2 and t not in stop_words and stem not in stop_words])
+            for x in chunk]
+
+
 def df_transform(df: pd.DataFrame) -> pd.DataFrame:
     """
     Transforms raw chat-bot dataframe into a more interpretable one, specifically:
@@ -25,37 +127,41 @@ def df_transform(df: pd.DataFrame) -> pd.DataFrame:
                '% участия бота', '% участия рекомендаций', '% участия оператора', 'Варианты ответов бота', 'Оценка чата', 'Название оценки',
                'Комментарий оценки', 'Почта операторов', 'Время на первый ответ, сек', 'Переменные чата']
     df = df.drop(to_drop, axis=1)
-    df['user'] = df['Пользователь'].str.replace(r'\n-', '')
-    df['user'] = df['user'].str.replace(r'\n.*', '')
-    df['operators'] = df['Операторы'].str.replace(r'\n', '')
-    df['operators'] = df['operators'].apply(lambda x: {} if type(x) is float else set(x.split(',')))
+    df['user'] = df['Пользователь'].str.replace(r'\n-', '', regex=True)
+    df['user'] = df['user'].str.replace(r'\n.*', '', regex=True)
+    # one set of operators per chat instead of one per exploded line
+    operators = df.drop_duplicates('ID чата').set_index('ID чата')['Операторы'].dropna()
+    operators_by_chat = operators.str.replace('\n', '', regex=False).str.split(',').map(frozenset).to_dict()
     df['chat_lines'] = df['Содержание чата'].str.findall(r'\d\d:\d\d:\d\d .*')
 
     df = df.explode('chat_lines')
 
-    df['time'] = df['chat_lines'].str.slice(stop=8)
-    df['sender'] = df['chat_lines'].apply(lambda x: x[9:9 + x[9:].find(':')]) # here the logic is a little harder
-    df['sender'] = df['sender'].str.replace(r' \(рекомендация\)', '')
+    # "HH:MM:SS sender: line", the sender ends at the first colon, lines without text are left as NaN
+    parts = df['chat_lines'].str.extract(r'^(?P<time>\d\d:\d\d:\d\d) (?P<sender>[^:]*):.(?P<line>.+)$')
+    df['time'] = parts['time']
+    df['sender'] = parts['sender'].str.replace(' (рекомендация)', '', regex=False)
     df['sender_name'] = df['sender']
-    df['line'] = df['chat_lines'].apply(lambda x: x[9 + x[9:].find(':') + 2:])
+    df['line'] = parts['line']
 
-    df = df[df['line'] != '']
-    df = df[df['user'] != '']
+    df = df[df['line'].notna() & (df['user'] != '')]
 
     df = df.drop(['Пользователь', 'Содержание чата', 'Операторы', 'chat_lines'], axis=1)
     df = df.rename(columns={'ID чата': 'chat_id', 'Тип канала': 'channel_type', 'Тематики': 'topics', 'Документы': 'documents',
                             'Реакция на ответы бота': 'reaction', 'Уверенность бота': 'bot_confidence', 'Среднее время на ответ, сек': 'mean_response_time'})
 
-    df.loc[df['sender'] == df['user'], 'sender'] = 'user'
-    df.loc[df['sender'] == 'Бот', 'sender'] = 'bot'
-    df.loc[df['sender'] == 'Комментарий', 'sender'] = 'comment'
+    text_columns = df.select_dtypes(include=['object', 'string']).columns
+    df[text_columns] = df[text_columns].astype('string[pyarrow]')
 
-    operator_map = []
-    for index, r in df.iterrows():
-        operator_map.append(r['sender'] in r['operators'])
-    df.loc[operator_map, 'sender'] = 'operator'
-
-    df = df.drop('operators', axis=1)
+    senders = df['sender'].to_numpy(dtype=object)
+    no_operators = frozenset()
+    is_operator = np.fromiter((s in operators_by_chat.get(chat_id, no_operators)
+                               for s, chat_id in zip(senders, df['chat_id'].to_numpy())), dtype=bool, count=len(df))
+    conditions = [df['sender'].eq(df['user']).to_numpy(dtype=bool, na_value=False),
+                  df['sender'].eq('Бот').to_numpy(dtype=bool, na_value=False),
+                  df['sender'].eq('Комментарий').to_numpy(dtype=bool, na_value=False),
+                  is_operator]
+    df['sender'] = pd.array(np.select(conditions, ['user', 'bot', 'comment', 'operator'], default=senders),
+                            dtype='string[pyarrow]')
 
     return df
 
@@ -78,6 +184,10 @@ class EM_Pomoshnik_TextPreprocessor:
         self.replacing_incident = replacing_incident
         self.replacing_shop = replacing_shop
 
+        # group names match the replacing_* attributes, a shop code never takes the first digits of an order code
+        self._re_codes = re.compile(r'(?P<order>\d{10}|\d{9})|(?P<incident>\d\d-\d{8})'
+                                    r'|(?P<shop>[a-zA-Z][a-zA-Z]\d\d(?!\d{7}))')
+
     def fit(self, data: pd.Series) -> None:
         """
         Fits the data into the preprocessor
@@ -99,9 +209,7 @@ class EM_Pomoshnik_TextPreprocessor:
         """
         self.data = self.data.str.lower()
 
-        self.__delete_order_codes()
-        self.__delete_incident_codes()
-        self.__delete_shop_codes()
+        self.__delete_codes()
         return self.data
 
     def fit_transform(self, data: pd.Series) -> pd.Series:
@@ -116,24 +224,13 @@ class EM_Pomoshnik_TextPreprocessor:
         self.fit(data)
         return self.transform()
 
-    def __delete_order_codes(self) -> None:
-        """
-        Removes order codes (e.g. 1526872280)
-        """
-        self.data = self.data.str.replace(r'\d\d\d\d\d\d\d\d\d\d', self.replacing_order)
-        self.data = self.data.str.replace(r'\d\d\d\d\d\d\d\d\d', self.replacing_order)
-
-    def __delete_shop_codes(self) -> None:
-        """
-        Removes shop codes (e.g. Sa25)
-        """
-        self.data = self.data.str.replace(r'[a-zA-Z][a-zA-Z]\d\d', self.replacing_shop)
-
-    def __delete_incident_codes(self) -> None:
+    def __delete_codes(self) -> None:
         """
-        Removes incident codes (e.g. 21-17929533)
+        Removes order codes (e.g. 1526872280), incident codes (e.g. 21-17929533) and shop codes (e.g. Sa25)
+        in a single scan
         """
-        self.data = self.data.str.replace(r'\d\d-\d\d\d\d\d\d\d\d', self.replacing_incident)
+        self.data = self.data.str.replace(self._re_codes, lambda m: getattr(self, 'replacing_' + m.lastgroup),
+                                          regex=True)
 
     def save_order_codes(self) -> pd.DataFrame:
         """
@@ -164,15 +261,17 @@ class TextPreprocessor:
     and extracts all numbers from the data (more info in save_numbers())
     """
 
-    def __init__(self, method: str, stop_words: list = [], pos: bool = False, replacing_word: str = ' '):
+    def __init__(self, method: str, stop_words: list = [], pos: bool = False, replacing_word: str = ' ',
+                 n_jobs: int = -1):
         """
         Initiates an instance of a text preprocessor
 
         Parameters:
             method: (str): Name of a preprocessing method (either stemming or lemmatization)
-            stop_words: (list): List of stop-words to be removed from the data
+            stop_words: (list): List of stop-words to be removed from the data (multi-word phrases require pyahocorasick)
             pos: (bool): Whether to apply pos-tagging during lemmatization (if chosen)
             replacing_word: (str): Word with which the numbers in the data will be replaced (by default an empty string)
+            n_jobs: (int): Number of processes for stemming/lemmatization of large data (-1 stands for all cores)
         """
         if not method in {'lemmatization', 'lemmatize', 'lemma', 'stemming', 'stem'}:
             raise Exception("This preprocessing method is not supported")
@@ -181,14 +280,35 @@ class TextPreprocessor:
         self.data = pd.Series(dtype=object)
         self.pos = pos
         self.replacing_word = replacing_word
-
+        self.n_jobs = n_jobs
+
+        # links, punctuation, numbers, ё (and latin words for lemmatization, otherwise russian lemmatize will break
+        # down) are handled in a single scan of the lowercased text, the group name picks the replacement
+        pattern = r'(?P<link>http\S+|www\S+)|(?P<punct>[^\w\s])|(?P<number>\d+)|(?P<ye>ё)'
+        if self.method == 'lemma' or self.method == 'lemmatize' or self.method == 'lemmatization':
+            pattern += r'|(?P<latin>[a-z]+)'
+        self._re_chars = re.compile(pattern)
+        self._chars_replacements = {'link': ' ', 'punct': ' ', 'number': self.replacing_word, 'ye': 'е', 'latin': ' '}
+
+        # the documents are cleaned before stop-words are matched, so the stop-words are cleaned the same way;
+        # those that turn into several words (e.g. из-за) become stop-phrases
+        cleaned = [' '.join(self.__clean(x).split()) for x in stop_words]
+        phrases = [x for x in cleaned if ' ' in x]
+        stop_words = [x for x in cleaned if x and ' ' not in x]
         if self.method == 'stem' or self.method == 'stemming':
-            ru_stemmer = SnowballStemmer(language='russian')
-            en_stemmer = PorterStemmer()
-            self.stop_words = [en_stemmer.stem(ru_stemmer.stem(x.lower())) for x in stop_words]
+            self.stop_words = [_stem_one(x) for x in stop_words]
         elif self.method == 'lemma' or self.method == 'lemmatize' or self.method == 'lemmatization':
-            morph = MorphAnalyzer()
-            self.stop_words = [morph.normal_forms(x.lower())[0] for x in stop_words]
+            self.stop_words = [_lemma_one(x) for x in stop_words]
+        self._stop_set = frozenset(self.stop_words)
+
+        # multi-word stop-phrases can't be dropped token by token, they are matched in the text beforehand
+        self._stop_phrases = None
+        if phrases:
+            import ahocorasick
+            self._stop_phrases = ahocorasick.Automaton()
+            for phrase in phrases:
+                self._stop_phrases.add_word(' ' + phrase + ' ', len(phrase) + 2)
+            self._stop_phrases.make_automaton()
 
     def fit(self, data: pd.Series) -> None:
         """
@@ -216,24 +336,13 @@ class TextPreprocessor:
         Returns:
             self.data: (pd.Series): Transformed data
         """
-        self.data = self.data.str.lower()
-
-        self.__delete_links()
-        self.__delete_punctuation()
-        self.__delete_numbers()
-        self.__change_to_ye()
-        self.__delete_stop_words()
+        self.__replace_chars()
 
         if self.method == 'stem' or self.method == 'stemming':
             self.__stem()
         elif self.method == 'lemma' or self.method == 'lemmatize' or self.method == 'lemmatization':
-            self.__delete_latin()  # otherwise russian lemmatize will break down
             self.__lemmatize()
 
-        self.__delete_short()  # не
-        self.__delete_stop_words()
-        self.__delete_whitespace()
-
         return self.data
 
     def fit_transform(self, data: pd.Series) -> pd.Series:
@@ -250,69 +359,42 @@ class TextPreprocessor:
 
     def __stem(self) -> None:
         """
-        Applies russian and english stemming using nltk's Snowball and Porter stemming methods
+        Applies russian and english stemming using nltk's Snowball and Porter stemming methods,
+        removes stop-words and words of 2 characters or less on the way
         """
-        ru_stemmer = SnowballStemmer(language='russian')
-        en_stemmer = PorterStemmer()
-        self.data = self.data.apply(lambda x: ' '.join([en_stemmer.stem(ru_stemmer.stem(y)) for y in x.split()]))
+        self.__map_chunks(_stem_chunk, self._stop_set, self._stop_phrases)
 
     def __lemmatize(self) -> None:
         """
-        Applies pymorhpy2 lemmatization and pos-tagging (if chosen in __init__)
+        Applies pymorhpy2 lemmatization and pos-tagging (if chosen in __init__),
+        removes stop-words and words of 2 characters or less on the way
         """
-        morph = MorphAnalyzer()
-        if self.pos:
-            self.data = self.data.apply(
-                lambda x: ' '.join([(morph.normal_forms(i)[0] + '_' + morph.parse(i)[0].tag.POS) for i in x.split()]))
-        else:
-            self.data = self.data.apply(lambda x: ' '.join([morph.normal_forms(i)[0] for i in x.split()]))
+        self.__map_chunks(_lemmatize_chunk, self._stop_set, self.pos, self._stop_phrases)
 
-    def __delete_stop_words(self) -> None:
+    def __map_chunks(self, func: callable, *args) -> None:
         """
-        Removes stop-words provided in __init__
+        Applies a chunk function to the data, splitting it between n_jobs processes if the data is large enough
         """
-        pattern = r'\b(?:{})\b'.format('|'.join(self.stop_words))
-        self.data = self.data.str.replace(pattern, '')
-
-    def __delete_punctuation(self) -> None:
-        """
-        Removes punctuation
-        """
-        self.data = self.data.str.replace(r'[^\w\s]', ' ')
-
-    def __delete_short(self) -> None:
-        """
-        Removes words of 2 characters or less
-        """
-        self.data = self.data.str.replace(r'\s[A-zА-я]{1,2}\s', ' ')
-
-    def __delete_numbers(self) -> None:
-        """
-        Removes numbers
-        """
-        self.data = self.data.str.replace(r'\d+', self.replacing_word)
-
-    def __change_to_ye(self) -> None:
-        """
-        Changes ё to e
-        """
-        self.data = self.data.str.replace('ё', 'е')
-
-    def __delete_links(self) -> None:
-        """
-        Removes all URLs
-        """
-        self.data = self.data.str.replace(r'http\S+', ' ')
-        self.data = self.data.str.replace(r'www\S+', ' ')
+        docs = self.data.to_numpy()
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs == 1 or len(docs) < _PARALLEL_MIN_ROWS:
+            res = func(docs, *args)
+        else:
+            chunks = np.array_split(docs, n_jobs)
+            parts = Parallel(n_jobs=n_jobs, backend='loky')(delayed(func)(c, *args) for c in chunks)
+            res = [x for part in parts for x in part]
+        self.data = pd.Series(res, index=self.data.index, dtype=object)
 
-    def __delete_latin(self) -> None:
+    def __replace_chars(self) -> None:
         """
-        Removes all words written with latin alphabet
+        Lowercases the data, removes all URLs, punctuation, numbers (and latin words for lemmatization),
+        changes ё to е
         """
-        self.data = self.data.str.replace(r'[A-Za-z\s]', ' ')
+        self.data = pd.Series([self.__clean(x) for x in self.data.to_numpy()],
+                              index=self.data.index, dtype=object)
 
-    def __delete_whitespace(self) -> None:
+    def __clean(self, doc: str) -> str:
         """
-        Removes all whitespace characters
+        Lowercases and cleans a single document (check __replace_chars())
         """
-        self.data = self.data.str.replace(r'\s+', ' ')
+        return self._re_chars.sub(lambda m: self._chars_replacements[m.lastgroup], doc.lower())
@@ -3,7 +3,8 @@ import numpy as np
 
 from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
 
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
 
 class Vectorizer:
     """
@@ -14,26 +15,33 @@ class Vectorizer:
         Initiates an instance of a chosen vectorizer with given key-word parameters
 
         Parameters:
-            v_type: (str): vectorizer type - (either tfidf, count, that stand for
-            TfidfVectorizer, CountVectorizer from sklearn respectively)
+            v_type: (str): vectorizer type - (either tfidf, count, hashing, hashing_tfidf, that stand for
+            TfidfVectorizer, CountVectorizer, HashingVectorizer and HashingVectorizer followed by TfidfTransformer
+            from sklearn respectively). Hashing vectorizers keep no vocabulary, so there are no feature names for them
 
-            **params: (key-word args): parameters to be passed
+            **params: (key-word args): parameters to be passed (for hashing_tfidf, plain parameter names go to
+            HashingVectorizer, TfidfTransformer ones are passed with the tfidf__ prefix)
         """
 
         self.__vectorizer = None
         self.__data = None
-        if not v_type in {'tfidf', 'count'}:
+        self.__analyzer = None
+        self.__tokenizer = None
+        self.__preprocessor = None
+        if not v_type in {'tfidf', 'count', 'hashing', 'hashing_tfidf'}:
             raise Exception('This vectorizer is not supported')
 
         if v_type == 'tfidf':
             self.__vectorizer = TfidfVectorizer()
         elif v_type == 'count':
             self.__vectorizer = CountVectorizer()
+        elif v_type == 'hashing':
+            self.__vectorizer = HashingVectorizer(n_features=2 ** 20, alternate_sign=False)
+        elif v_type == 'hashing_tfidf':
+            self.__vectorizer = Pipeline([('hv', HashingVectorizer(n_features=2 ** 20, alternate_sign=False)),
+                                          ('tfidf', TfidfTransformer())])
 
-        for p_key in params.keys():
-            if not p_key in self.__vectorizer.get_params().keys():
-                raise Exception(f'There is no such parameter in {type(self.__vectorizer)}')
-        self.__vectorizer.set_params(**params)
+        self.set_params(**params)
 
     def fit(self, X: pd.Series) -> None:
         """
@@ -52,6 +60,8 @@ class Vectorizer:
         Returns:
             features: (list): feature names
         """
+        if isinstance(self.__text_vectorizer(), HashingVectorizer):
+            raise Exception('Hashing vectorizers have no feature names')
         return self.__vectorizer.get_feature_names()
 
     def get_stop_words(self) -> list:
@@ -61,7 +71,7 @@ class Vectorizer:
         Returns:
             stop_words: (list): stop words
         """
-        return self.__vectorizer.get_stop_words()
+        return self.__text_vectorizer().get_stop_words()
 
     def transform(self, X: pd.Series=None) -> pd.DataFrame:
         """
@@ -106,35 +116,52 @@ class Vectorizer:
         Parameters:
             **params: (key-words args): parameters to be passed
         """
+        if isinstance(self.__vectorizer, Pipeline):
+            params = {p_key if '__' in p_key else 'hv__' + p_key: v for p_key, v in params.items()}
+        for p_key in params.keys():
+            if not p_key in self.__vectorizer.get_params().keys():
+                raise Exception(f'There is no such parameter in {type(self.__vectorizer)}')
         self.__vectorizer.set_params(**params)
+        self.__analyzer = None
+        self.__tokenizer = None
+        self.__preprocessor = None
 
     def build_analyzer(self) -> callable:
         """
         Builds and returns a callable function that preprocesses input data and generates tokens and
         n-grams based on it
+        (built once and reused until set_params() is called)
 
         Returns:
             analyzer: (callable): built analyzer function
         """
-        return self.__vectorizer.build_analyzer()
+        if self.__analyzer is None:
+            self.__analyzer = self.__text_vectorizer().build_analyzer()
+        return self.__analyzer
 
     def build_tokenizer(self) -> callable:
         """
         Builds and returns a callable function for splitting a string into a sequence of tokens
+        (built once and reused until set_params() is called)
 
         Returns:
             tokenizer: (callable): built tokenizer function
         """
-        return self.__vectorizer.build_tokenizer()
+        if self.__tokenizer is None:
+            self.__tokenizer = self.__text_vectorizer().build_tokenizer()
+        return self.__tokenizer
 
     def build_preprocessor(self) -> callable:
         """
         Builds and returns a callable function for preprocessing text before tokenization
+        (built once and reused until set_params() is called)
 
         Returns:
             preprocessor: (callable): built preprocessing function
         """
-        return self.__vectorizer.build_preprocessor()
+        if self.__preprocessor is None:
+            self.__preprocessor = self.__text_vectorizer().build_preprocessor()
+        return self.__preprocessor
 
     def decode(self, doc: str) -> str:
         """
@@ -146,4 +173,12 @@ class Vectorizer:
         Returns:
             doc: (str): decoded string
         """
-        return self.__vectorizer.decode(doc)
+        return self.__text_vectorizer().decode(doc)
+
+    def __text_vectorizer(self):
+        """
+        Returns the part of the vectorizer that works with raw text (the HashingVectorizer step for hashing_tfidf)
+        """
+        if isinstance(self.__vectorizer, Pipeline):
+            return self.__vectorizer.named_steps['hv']
+        return self.__vectorizer